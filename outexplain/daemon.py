@@ -0,0 +1,220 @@
+# Standard library
+import os
+import sys
+import json
+import time
+import hashlib
+import socket
+import tempfile
+import socketserver
+import subprocess
+from subprocess import DEVNULL
+from pathlib import Path
+from typing import Iterator, Optional
+
+# Local
+from outexplain.utils import _bool_env, _private_dir, get_llm_provider, stream_explanation
+
+# --------------------
+# Configuration / Const
+# --------------------
+# A warm worker keeps the interpreter and provider SDKs loaded between invocations.
+DAEMON_IDLE_TIMEOUT = float(os.getenv("OUTEXPLAIN_DAEMON_IDLE", "300"))
+DAEMON_CONNECT_TIMEOUT = 3.0
+_CONNECT_RETRY_INTERVAL = 0.05
+# Model settings the worker must share with the caller; sent with every request and checked.
+_MODEL_ENV_KEYS = ("OPENAI_MODEL", "OPENAI_BASE_URL", "OLLAMA_MODEL", "OUTEXPLAIN_CACHE_TTL", "OUTEXPLAIN_BATCH")
+# Credentials are never sent; they only select which worker (socket) a caller talks to.
+_CREDENTIAL_ENV_KEYS = ("OPENAI_API_KEY", "ANTHROPIC_API_KEY")
+
+# ---------------- Socket location ----------------
+def available() -> bool:
+    return hasattr(socket, "AF_UNIX") and hasattr(socketserver, "ThreadingUnixStreamServer")
+
+def daemon_enabled() -> bool:
+    return _bool_env("OUTEXPLAIN_DAEMON") and available()
+
+def _model_env() -> dict:
+    return {key: os.getenv(key) for key in _MODEL_ENV_KEYS}
+
+def _env_fingerprint() -> str:
+    """Short digest of the provider configuration; a worker only serves callers with the same one."""
+    raw = "\0".join(f"{key}={os.getenv(key) or ''}" for key in _CREDENTIAL_ENV_KEYS + _MODEL_ENV_KEYS)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest()
+
+def socket_path() -> Optional[str]:
+    """Socket inside a 0700 directory owned by the current user, or ``None`` if there is none.
+
+    The terminal context is sent before redaction, so a name someone else could bind first
+    (e.g. a fixed path in /tmp) must never be used.
+    """
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        base = Path(runtime_dir) / "outexplain"
+    else:
+        owner = os.getuid() if hasattr(os, "getuid") else "user"
+        base = Path(tempfile.gettempdir()) / f"outexplain-{owner}"
+    directory = _private_dir(base)
+    return str(directory / f"daemon-{_env_fingerprint()}.sock") if directory else None
+
+def _connect(path: str) -> Optional[socket.socket]:
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return sock
+    except OSError:
+        sock.close()
+        return None
+
+# ---------------- Server ----------------
+class _Handler(socketserver.StreamRequestHandler):
+    """One JSON request line in; JSON lines out: ``{"text"}`` chunks, then ``{"done"}`` or ``{"error"}``."""
+
+    def _send(self, **message) -> bool:
+        try:
+            self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+            return True
+        except OSError:
+            # Client went away (Ctrl-C); nothing left to deliver.
+            return False
+
+    def handle(self) -> None:
+        try:
+            request = json.loads(self.rfile.readline())
+            if request.get("env") != _model_env():
+                raise RuntimeError("outexplain daemon was started with a different model configuration.")
+            chunks = stream_explanation(request["context"], request.get("query"),
+                                        provider=request.get("provider"), model=request.get("model"))
+            for chunk in chunks:
+                if not self._send(text=chunk):
+                    return
+        except Exception as exc:
+            self._send(error=" ".join(str(exc).split()) or type(exc).__name__)
+            return
+        self._send(done=True)
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    timeout = DAEMON_IDLE_TIMEOUT
+    idle = False
+
+    def handle_timeout(self) -> None:
+        self.idle = True
+
+def _warm_imports() -> None:
+    for module in ("anthropic", "openai", "ollama"):
+        try:
+            __import__(module)
+        except Exception:
+            pass
+
+def serve(path: Optional[str] = None) -> None:
+    path = path or socket_path()
+    if path is None:
+        return
+    if os.path.exists(path):
+        live = _connect(path)
+        if live is not None:
+            # Another daemon won the race; leave it alone.
+            live.close()
+            return
+        os.unlink(path)
+    os.umask(0o077)
+    server = _Server(path, _Handler)
+    try:
+        _warm_imports()
+        while not server.idle:
+            server.handle_request()
+    finally:
+        server.server_close()
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+# ---------------- Client ----------------
+def _spawn() -> None:
+    subprocess.Popen([sys.executable, "-m", "outexplain.daemon"], stdin=DEVNULL, stdout=DEVNULL,
+                     stderr=DEVNULL, start_new_session=True)
+
+def _read_message(reader) -> Optional[dict]:
+    try:
+        line = reader.readline()
+    except OSError:
+        return None
+    if not line:
+        return None
+    try:
+        message = json.loads(line)
+    except ValueError:
+        return None
+    return message if isinstance(message, dict) else None
+
+def _read_response(sock: socket.socket, reader, message: dict) -> Iterator[str]:
+    try:
+        while message is not None:
+            if "error" in message:
+                raise RuntimeError(message["error"])
+            if message.get("done"):
+                return
+            yield message.get("text", "")
+            message = _read_message(reader)
+        # No "done" marker: the worker died mid-answer, so don't pass this off as complete.
+        raise RuntimeError("outexplain daemon stopped before the answer was complete.")
+    finally:
+        reader.close()
+        sock.close()
+
+def stream_via_daemon(context: str, query: Optional[str] = None, provider: Optional[str] = None,
+                      model: Optional[str] = None) -> Optional[Iterator[str]]:
+    """Stream an explanation from the background worker, starting it if needed.
+
+    Returns ``None`` when no worker can be reached, so callers fall back to
+    :func:`outexplain.utils.stream_explanation` in-process.
+    """
+    if not available():
+        return None
+    path = socket_path()
+    if path is None:
+        return None
+    # Resolve here, not in the worker: its environment is the one it was spawned with.
+    provider = provider or get_llm_provider()
+    sock = _connect(path)
+    if sock is None:
+        try:
+            _spawn()
+        except OSError:
+            return None
+        deadline = time.monotonic() + DAEMON_CONNECT_TIMEOUT
+        while sock is None and time.monotonic() < deadline:
+            time.sleep(_CONNECT_RETRY_INTERVAL)
+            sock = _connect(path)
+        if sock is None:
+            return None
+    request = {"context": context, "query": query, "provider": provider, "model": model, "env": _model_env()}
+    reader = sock.makefile("rb")
+    try:
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+    except OSError:
+        pass
+    # Wait for the first message so early failures surface while the caller's spinner is up.
+    first = _read_message(reader)
+    if first is None:
+        reader.close()
+        sock.close()
+        return None
+    if "error" in first:
+        reader.close()
+        sock.close()
+        raise RuntimeError(first["error"])
+    return _read_response(sock, reader, first)
+
+def main() -> None:
+    if not available():
+        sys.exit("outexplain daemon needs Unix domain sockets.")
+    if socket_path() is None:
+        sys.exit("outexplain daemon has no private directory for its socket.")
+    serve()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,121 +1,188 @@
 # Standard library
 import os
+import re
 import sys
+import time
+import heapq
 import argparse
 import platform
 import subprocess
-from typing import Literal, Optional, List
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Literal, Optional, List, Tuple
 from pathlib import Path
 
-# Third party
-from rich.console import Console
-
 # Local
 from outexplain.storage import append_history, read_history
 from outexplain.utils import (
     Command,
     MAX_COMMANDS_DEFAULT,
     MAX_HISTORY_LINES,
+    SHELL_TIMEOUT,
     Shell,
     build_context_from_commands,
     choose_symbols,
     detect_terminal_info,
-    explain,
+    explain_batch,
+    format_output,
     format_terminal_info,
     get_commands,
+    get_pane_output,
     get_shell,
+    get_shell_name,
     get_terminal_context,
+    stream_explanation,
+    tail_lines,
     truncate_commands,
 )
 
+_IS_WINDOWS = platform.system() == "Windows"
+_APPDATA = os.getenv("APPDATA", "")
+_PROVIDER_ENV_KEYS = ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "OLLAMA_MODEL")
+
+# How often the streamed answer is re-rendered.
+LIVE_REFRESH_PER_SECOND = 10
+# Only the most recent transcripts are worth reading; older ones rarely hold the last command.
+PS_TRANSCRIPT_CANDIDATES = 4
+
+# History lines that are our own invocations and must not be sent as context.
+_OUTEXPLAIN_RE = re.compile(r"^\s*(?:outexplain\b|python\s+-m\s+outexplain\b)", re.IGNORECASE)
+# zsh extended history (": 1700000000:0;ls") and `history` output (" 203  ls").
+_ZSH_HISTORY_RE = re.compile(r"^:\s*\d+:\d+;(.*)$")
+_NUMBERED_HISTORY_RE = re.compile(r"^\s*\d+\s+(.*)$")
+# bash writes "#<epoch>" before each entry when HISTTIMEFORMAT is set.
+_HISTORY_TIMESTAMP_RE = re.compile(r"^#\d+$")
+
 
 # ---------------------------
 # Console color system helper
 # ---------------------------
+@lru_cache(maxsize=8)
 def _color_system_from_depth(depth: int) -> Literal["auto", "standard", "256", "truecolor", "windows"]:
     if depth >= 24:
         return "truecolor"
     if depth >= 256:
         return "256"
-    if platform.system() == "Windows":
+    if _IS_WINDOWS:
         return "windows"
     return "standard"
 
 
-def _read_last_commands_from_ps_history(max_count: int) -> List[Command]:
-    appdata = os.getenv("APPDATA", "")
+def _read_last_commands_from_ps_history(max_count: int) -> Tuple[List[Command], bool]:
     paths = [
-        Path(appdata) / "Microsoft" / "PowerShell" / "PSReadLine" / "ConsoleHost_history.txt",
-        Path(appdata) / "Microsoft" / "Windows" / "PowerShell" / "PSReadLine" / "ConsoleHost_history.txt",
+        Path(_APPDATA) / "Microsoft" / "PowerShell" / "PSReadLine" / "ConsoleHost_history.txt",
+        Path(_APPDATA) / "Microsoft" / "Windows" / "PowerShell" / "PSReadLine" / "ConsoleHost_history.txt",
         ]
-    existing = [p for p in paths if p.exists()]
-    if not existing:
-        return []
-    path = max(existing, key=lambda p: p.stat().st_mtime)
+    best: Optional[tuple[float, Path]] = None
+    for candidate in paths:
+        try:
+            mtime = os.stat(candidate).st_mtime
+        except OSError:
+            continue
+        if best is None or mtime > best[0]:
+            best = (mtime, candidate)
+    if best is None:
+        return [], False
+    path = best[1]
     try:
         lines = path.read_text(encoding="utf-8", errors="ignore").splitlines()
     except Exception:
-        return []
-    commands: List[str] = [ln.strip() for ln in lines if
-            ln.strip() and not ln.lower().startswith(("outexplain", "python -m outexplain"))][-max_count:]
-    return [Command(text=c, output="") for c in commands]
+        return [], False
+    commands: deque[str] = deque(maxlen=max_count)
+    for ln in lines:
+        stripped = ln.strip()
+        if not stripped or _OUTEXPLAIN_RE.match(stripped):
+            continue
+        commands.append(stripped)
+    # PSReadLine only records command lines, never their output.
+    return [Command(text=c, output="") for c in commands], True
 
 
-def _read_commands_from_ps_transcript(max_count: int) -> List[Command]:
+def _read_commands_from_ps_transcript(max_count: int) -> Tuple[List[Command], bool]:
     docs = Path.home() / "Documents"
-    candidates = sorted(docs.glob("PowerShell_transcript*.txt"), key=lambda p: p.stat().st_mtime, reverse=True)
+    try:
+        with os.scandir(docs) as it:
+            # On Windows DirEntry.stat() is served from the directory listing, so no extra syscalls.
+            entries = ((entry.stat(follow_symlinks=False).st_mtime, entry.path) for entry in it
+                       if entry.name.startswith("PowerShell_transcript") and entry.name.endswith(".txt"))
+            newest = heapq.nlargest(PS_TRANSCRIPT_CANDIDATES, entries)
+    except OSError:
+        return [], False
+    candidates = [path for _, path in newest]
     for path in candidates:
         try:
-            text = path.read_text(encoding="utf-8", errors="ignore")
+            slice_text = "\n".join(tail_lines(path, MAX_HISTORY_LINES))
         except Exception:
             continue
-        slice_text = "\n".join(text.splitlines()[-MAX_HISTORY_LINES:])
         shell = Shell(path=str(path), name="powershell", prompt=">")
         commands = get_commands(slice_text, shell, max_commands=max_count)
         if commands:
-            return commands
-    return []
+            # Transcripts carry real output; whether any is missing is judged after truncation.
+            return commands, False
+    return [], False
+
+
+def _has_missing_output(commands: List[Command]) -> bool:
+    return any(not cmd.output or not cmd.output.strip() for cmd in commands)
 
 
 def _clean_history_line(line: str) -> Optional[str]:
     line = line.strip()
-    if not line:
+    if not line or _HISTORY_TIMESTAMP_RE.match(line):
         return None
-    if line.lower().startswith(("outexplain", "python -m outexplain")):
+    match = _ZSH_HISTORY_RE.match(line) or _NUMBERED_HISTORY_RE.match(line)
+    if match:
+        line = match.group(1).strip()
+    if _OUTEXPLAIN_RE.match(line):
         return None
-    if line.startswith(":") and ";" in line:
-        # zsh style timestamped history
-        line = line.split(";", 1)[1].strip()
-    if line and line[0].isdigit() and " " in line:
-        # history output like " 203  ls"
-        line = line.split(" ", 1)[1].strip()
     return line or None
 
 
-def _has_missing_output(commands: List[Command]) -> bool:
-    return any(not (cmd.output or "").strip() for cmd in commands)
+def _read_stdin() -> str:
+    try:
+        if not sys.stdin.isatty():
+            return sys.stdin.read()
+    except Exception:
+        pass
+    return ""
 
 
 # ---------------------------
 # Bash / Git Bash / Zsh helpers
 # ---------------------------
-def _read_bashlike_history(shell_path: Optional[str], max_count: int) -> List[Command]:
+def _bashlike_histfile(shell_path: Optional[str]) -> Path:
+    if os.getenv("HISTFILE"):
+        return Path(os.environ["HISTFILE"]).expanduser()
+    if get_shell_name(shell_path) == "zsh":
+        return Path.home() / ".zsh_history"
+    return Path.home() / ".bash_history"
+
+
+def _read_bashlike_history(shell_path: Optional[str], max_count: int) -> Tuple[List[Command], bool]:
     exe = shell_path or "bash"
     commands: List[str] = []
 
+    # The history file is the canonical source and avoids spawning a login shell.
+    histfile = _bashlike_histfile(shell_path)
     try:
-        proc = subprocess.run([exe, "-lc", f"fc -ln -n -{max_count}"],
-                              text=True, capture_output=True, cwd=os.getcwd())
-        if proc.stdout:
-            cleaned = [_clean_history_line(ln) for ln in proc.stdout.splitlines()]
-            commands = [ln for ln in cleaned if ln]
+        # Timestamps and our own invocations can fill any fixed window; widen it until
+        # enough real commands turn up or the start of the file is reached.
+        window = max_count * 2
+        while True:
+            lines = tail_lines(histfile, window)
+            commands = [ln for ln in map(_clean_history_line, lines) if ln]
+            if len(commands) >= max_count or len(lines) < window:
+                break
+            window *= 2
     except Exception:
         commands = []
 
     if not commands:
         try:
-            proc = subprocess.run([exe, "-lc", f"HISTTIMEFORMAT= history | tail -n {max_count}"],
-                                  text=True, capture_output=True, cwd=os.getcwd())
+            proc = subprocess.run([exe, "-lc", f"fc -ln -n -{max_count}"],
+                                  text=True, capture_output=True, stdin=subprocess.DEVNULL,
+                                  cwd=os.getcwd(), timeout=SHELL_TIMEOUT)
             if proc.stdout:
                 cleaned = [_clean_history_line(ln) for ln in proc.stdout.splitlines()]
                 commands = [ln for ln in cleaned if ln]
@@ -123,25 +190,27 @@ def _read_bashlike_history(shell_path: Optional[str], max_count: int) -> List[Co
             commands = []
 
     if not commands:
-        histfile = Path(os.getenv("HISTFILE") or (Path.home() / ".bash_history")).expanduser()
-        if histfile.exists():
-            try:
-                commands = [
-                    _clean_history_line(ln) or "" for ln in histfile.read_text(encoding="utf-8", errors="ignore").splitlines()
-                ]
-                commands = [ln for ln in commands if ln]
-            except Exception:
-                commands = []
+        try:
+            proc = subprocess.run([exe, "-lc", f"HISTTIMEFORMAT= history | tail -n {max_count}"],
+                                  text=True, capture_output=True, stdin=subprocess.DEVNULL,
+                                  cwd=os.getcwd(), timeout=SHELL_TIMEOUT)
+            if proc.stdout:
+                cleaned = [_clean_history_line(ln) for ln in proc.stdout.splitlines()]
+                commands = [ln for ln in cleaned if ln]
+        except Exception:
+            commands = []
 
-    commands = [cmd for cmd in commands if cmd][:max_count]
-    return [Command(text=cmd, output="") for cmd in commands]
+    commands = [cmd for cmd in commands if cmd][-max_count:]
+    # Shell history only records command lines, never their output.
+    return [Command(text=cmd, output="") for cmd in commands], True
 
 
 def combine_user_messages(messages: List[str], summary: bool = False) -> str:
-    user_messages = [msg.strip() for msg in messages if msg and msg.strip()]
+    combined = "\n".join(stripped for msg in messages if msg and (stripped := msg.strip()))
     if summary:
-        user_messages.append("Summarize the last command/output in 3-5 bullet points.")
-    return "\n".join(user_messages).strip()
+        summary_request = "Summarize the last command/output in 3-5 bullet points."
+        combined = f"{combined}\n{summary_request}" if combined else summary_request
+    return combined
 
 
 # ---------------------------
@@ -176,91 +245,157 @@ def main() -> None:
     parser.add_argument("--no-log", action="store_true", help="Disable writing invocation history to disk.")
     parser.add_argument("--review", "-n", type=int, default=None,
                         help="Review the N most recent command/output pairs from the history log when live capture is unavailable.")
+    parser.add_argument("--batch", metavar="FILE", default=None,
+                        help="Ask each non-empty line of FILE as a separate query about the same output, concurrently.")
     args = parser.parse_args()
 
-    # Detect shell
-    shell = get_shell()
-    term_info = detect_terminal_info(shell)
-    symbols = choose_symbols(term_info)
-    console = Console(color_system=_color_system_from_depth(term_info.color_depth))
-    if args.debug or args.debug_env:
-        console.print(f"[dim]{format_terminal_info(term_info)}[/dim]")
-
-    # Merge message + query
-    user_message = combine_user_messages(args.messages, summary=args.summary)
-
-    status_text = f"{symbols['info']} Trying my best..."
-    with console.status(f"[bold green]{status_text}"):
-
-        if (not os.environ.get("OPENAI_API_KEY") and not os.environ.get("ANTHROPIC_API_KEY")
-                and not os.environ.get("OLLAMA_MODEL") and not args.provider):
-            console.print(
-                f"[bold red]{symbols['fail']} No model configured.[/bold red]\n"
-                "Set OPENAI_API_KEY or ANTHROPIC_API_KEY, or provide an OLLAMA_MODEL.\n"
-                "Tip: set OPENAI_MODEL=gpt-4o or run with --provider ollama --model llama3.1"
-            )
-            return
-
-        stdin_data = ""
+    batch_queries: List[str] = []
+    if args.batch:
         try:
-            if not sys.stdin.isatty():
-                stdin_data = sys.stdin.read()
-        except Exception:
-            stdin_data = ""
-
-        in_tmux_or_screen = bool(os.getenv("TMUX") or os.getenv("STY"))
-        is_windows = platform.system() == "Windows"
-        is_powershell = (shell.name in {"pwsh", "powershell"})
-        is_bashlike = (shell.name in {"bash", "zsh"})
-
-        max_requested = args.last if (isinstance(args.last, int) and args.last > 0) else None
-        cap = max_requested or MAX_COMMANDS_DEFAULT
-
-        commands: List[Command] = []
-        terminal_context = ""
-
-        if in_tmux_or_screen:
-            terminal_context, commands = get_terminal_context(shell, max_commands=cap, return_commands=True)
-        elif stdin_data.strip():
-            terminal_context = f"<terminal_history>\n{stdin_data.strip()}\n</terminal_history>"
-        elif is_windows and is_powershell:
-            commands = _read_commands_from_ps_transcript(max_count=cap)
-            if not commands:
-                commands = _read_last_commands_from_ps_history(max_count=cap)
-            if commands:
-                commands = truncate_commands(commands, max_commands=cap)
-                if _has_missing_output(commands):
-                    console.print(f"[bold yellow]{symbols['warn']} Some command outputs are missing; context includes history only.[/bold yellow]")
-                terminal_context = build_context_from_commands(commands, shell.prompt or "PS>")
-        elif is_bashlike:
-            commands = _read_bashlike_history(shell.path, max_count=cap)
-            if commands:
-                commands = truncate_commands(commands, max_commands=cap)
-                if _has_missing_output(commands):
-                    console.print(f"[bold yellow]{symbols['warn']} Some command outputs are missing; context includes history only.[/bold yellow]")
-                terminal_context = build_context_from_commands(commands, shell.prompt or "$")
-
-        if not terminal_context and args.review:
-            review_commands, review_prompt = read_history(args.review)
-            if review_commands:
-                commands = review_commands
-                terminal_context = build_context_from_commands(commands, review_prompt or shell.prompt or "$")
-                console.print(f"[dim]{symbols['info']} Using stored history log.[/dim]")
-
-        if not terminal_context:
-            if is_windows and is_powershell:
-                console.print(f"[bold yellow]{symbols['warn']} Couldn't read PSReadLine history.[/bold yellow]")
+            lines = Path(args.batch).read_text(encoding="utf-8").splitlines()
+        except OSError as exc:
+            parser.error(f"cannot read --batch file: {exc}")
+        batch_queries = [ln.strip() for ln in lines if ln.strip()]
+
+    # Deferred so `--help` and argument errors don't pay for rich's import.
+    from rich.console import Console
+
+    # Env-only check, done before any background read starts: the pool's threads are joined at
+    # exit, so a pending stdin read would otherwise hold this early return until EOF.
+    env = os.environ
+    if not args.provider and not any(env.get(key) for key in _PROVIDER_ENV_KEYS):
+        term_info = detect_terminal_info(Shell(None, None, None))
+        symbols = choose_symbols(term_info)
+        console = Console(color_system=_color_system_from_depth(term_info.color_depth))
+        console.print(
+            f"[bold red]{symbols['fail']} No model configured.[/bold red]\n"
+            "Set OPENAI_API_KEY or ANTHROPIC_API_KEY, or provide an OLLAMA_MODEL.\n"
+            "Tip: set OPENAI_MODEL=gpt-4o or run with --provider ollama --model llama3.1"
+        )
+        return
+
+    in_tmux_or_screen = bool(os.getenv("TMUX") or os.getenv("STY"))
+    # Pane capture, stdin and history reads are independent I/O; run them alongside the
+    # slow shell prompt probe instead of one after another.
+    pool = ThreadPoolExecutor(max_workers=3)
+    try:
+        pane_future = pool.submit(get_pane_output) if in_tmux_or_screen else None
+        stdin_future = pool.submit(_read_stdin)
+
+        # Detect shell
+        shell = get_shell()
+        term_info = detect_terminal_info(shell)
+        symbols = choose_symbols(term_info)
+        console = Console(color_system=_color_system_from_depth(term_info.color_depth))
+        if args.debug or args.debug_env:
+            console.print(f"[dim]{format_terminal_info(term_info)}[/dim]")
+
+        # Merge message + query
+        user_message = combine_user_messages(args.messages, summary=args.summary)
+
+        status_text = f"{symbols['info']} Trying my best..."
+        with console.status(f"[bold green]{status_text}"):
+
+            is_windows = _IS_WINDOWS
+            is_powershell = (shell.name in {"pwsh", "powershell"})
+            is_bashlike = (shell.name in {"bash", "zsh"})
+
+            max_requested = args.last if (isinstance(args.last, int) and args.last > 0) else None
+            cap = max_requested or MAX_COMMANDS_DEFAULT
+
+            commands: List[Command] = []
+            terminal_context = ""
+
+            # Piped input wins over history, so only start history reads once stdin came up empty;
+            # abandoned futures would still be joined (and login shells waited on) at exit.
+            stdin_data = stdin_future.result()
+            transcript_future = history_future = None
+            if not in_tmux_or_screen and not stdin_data.strip():
+                if is_windows and is_powershell:
+                    transcript_future = pool.submit(_read_commands_from_ps_transcript, max_count=cap)
+                    history_future = pool.submit(_read_last_commands_from_ps_history, max_count=cap)
+                elif is_bashlike:
+                    history_future = pool.submit(_read_bashlike_history, shell.path, max_count=cap)
+
+            if in_tmux_or_screen:
+                terminal_context, commands = get_terminal_context(shell, max_commands=cap, return_commands=True,
+                                                                  pane_output=pane_future.result())
+            elif stdin_data.strip():
+                terminal_context = f"<terminal_history>\n{stdin_data.strip()}\n</terminal_history>"
+            elif is_windows and is_powershell:
+                commands, missing_output = transcript_future.result()
+                if not commands:
+                    commands, missing_output = history_future.result()
+                if commands:
+                    commands = truncate_commands(commands, max_commands=cap)
+                    if missing_output or _has_missing_output(commands):
+                        console.print(f"[bold yellow]{symbols['warn']} Some command outputs are missing; context includes history only.[/bold yellow]")
+                    terminal_context = build_context_from_commands(commands, shell.prompt or "PS>")
             elif is_bashlike:
-                console.print(f"[bold yellow]{symbols['warn']} Could not retrieve recent history from bash/zsh.[/bold yellow]")
+                commands, missing_output = history_future.result()
+                if commands:
+                    commands = truncate_commands(commands, max_commands=cap)
+                    if missing_output:
+                        console.print(f"[bold yellow]{symbols['warn']} Some command outputs are missing; context includes history only.[/bold yellow]")
+                    terminal_context = build_context_from_commands(commands, shell.prompt or "$")
+
+            if not terminal_context and args.review:
+                review_commands, review_prompt = read_history(args.review)
+                if review_commands:
+                    commands = review_commands
+                    terminal_context = build_context_from_commands(commands, review_prompt or shell.prompt or "$")
+                    console.print(f"[dim]{symbols['info']} Using stored history log.[/dim]")
+
+            if not terminal_context:
+                if is_windows and is_powershell:
+                    console.print(f"[bold yellow]{symbols['warn']} Couldn't read PSReadLine history.[/bold yellow]")
+                elif is_bashlike:
+                    console.print(f"[bold yellow]{symbols['warn']} Could not retrieve recent history from bash/zsh.[/bold yellow]")
+                else:
+                    console.print(f"[bold yellow]{symbols['warn']} No tmux/screen or input detected.[/bold yellow]")
+                return
+
+            append_history(commands, shell, enabled=not args.no_log, log_level=args.log_level)
+
+            if batch_queries:
+                items = [(terminal_context, combine_user_messages([*args.messages, query], summary=args.summary))
+                         for query in batch_queries]
+                responses = explain_batch(items, provider=args.provider, model=args.model)
             else:
-                console.print(f"[bold yellow]{symbols['warn']} No tmux/screen or input detected.[/bold yellow]")
-            return
-
-        append_history(commands, shell, enabled=not args.no_log, log_level=args.log_level)
-
-        response = explain(terminal_context, user_message, provider=args.provider, model=args.model)
-
-    console.print(response)
+                chunks = None
+                if os.getenv("OUTEXPLAIN_DAEMON"):
+                    # Imported only when asked for; the socket machinery isn't free at startup.
+                    from outexplain.daemon import daemon_enabled, stream_via_daemon
+                    if daemon_enabled():
+                        chunks = stream_via_daemon(terminal_context, user_message, provider=args.provider,
+                                                   model=args.model)
+                if chunks is None:
+                    chunks = stream_explanation(terminal_context, user_message, provider=args.provider, model=args.model)
+                # Keep the spinner up until the first token arrives.
+                response = next(chunks, "")
+    finally:
+        # Drop queued work we no longer need; a read already running is still joined at exit.
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if batch_queries:
+        from rich.text import Text
+        for query, rendered in zip(batch_queries, responses):
+            console.rule(Text(query, style="bold"))
+            console.print(rendered)
+        return
+
+    from rich.live import Live
+    # Re-parsing the Markdown per chunk is quadratic; rebuild it at most once per refresh.
+    parts = [response]
+    with Live(format_output(response), console=console, refresh_per_second=LIVE_REFRESH_PER_SECOND) as live:
+        last_render = time.monotonic()
+        for chunk in chunks:
+            parts.append(chunk)
+            now = time.monotonic()
+            if now - last_render >= 1 / LIVE_REFRESH_PER_SECOND:
+                live.update(format_output("".join(parts)))
+                last_render = now
+        live.update(format_output("".join(parts)))
 
 
 if __name__ == "__main__":
@@ -5,14 +5,36 @@ from datetime import datetime, timezone
 from pathlib import Path
 from typing import List, Optional, Tuple
 
+# Third party (optional)
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 # Local
-from outexplain.utils import Command, Shell, sanitize_text
+from outexplain.utils import Command, Shell, sanitize_text, tail_bytes, tail_lines
 
 HISTORY_PATH = Path(os.getenv("OUTEXPLAIN_HISTORY_PATH", "")).expanduser()
 if not HISTORY_PATH:
     HISTORY_PATH = Path.home() / ".outexplain" / "history.jsonl"
 
 MAX_HISTORY_BYTES = int(os.getenv("OUTEXPLAIN_HISTORY_MAX_BYTES", "1048576"))
+# Let the log overshoot by 10% before rewriting it, so rotation is amortized over many appends.
+HISTORY_ROTATE_RATIO = 1.1
+# Entries carrying this marker were sanitized before being written.
+HISTORY_FORMAT_VERSION = 1
+
+
+def _dumps(entry: dict) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(entry)
+    return json.dumps(entry, ensure_ascii=False).encode("utf-8")
+
+
+def _loads(line: str) -> dict:
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
 
 
 def _ensure_history_dir() -> None:
@@ -21,18 +43,15 @@ def _ensure_history_dir() -> None:
 
 def _enforce_size_limit(path: Path) -> None:
     try:
-        if not path.exists() or path.stat().st_size <= MAX_HISTORY_BYTES:
+        size = path.stat().st_size
+        if size <= MAX_HISTORY_BYTES * HISTORY_ROTATE_RATIO:
             return
-        lines = path.read_text(encoding="utf-8", errors="ignore").splitlines()
-        retained: list[str] = []
-        total = 0
-        for line in reversed(lines):
-            total += len(line.encode("utf-8")) + 1  # account for newline
-            if total > MAX_HISTORY_BYTES:
-                break
-            retained.append(line)
-        retained = list(reversed(retained))
-        path.write_text("\n".join(retained) + ("\n" if retained else ""), encoding="utf-8")
+        # One extra leading byte shows whether the cut fell right after a newline; everything up
+        # to the first newline is then either that byte alone or a genuinely partial entry.
+        retained = tail_bytes(path, MAX_HISTORY_BYTES + 1)
+        newline = retained.find(b"\n")
+        retained = retained[newline + 1:] if newline != -1 else b""
+        path.write_bytes(retained)
     except Exception:
         # Best-effort: ignore rotation errors
         return
@@ -44,17 +63,22 @@ def append_history(commands: List[Command], shell: Shell, enabled: bool = True,
     _ensure_history_dir()
     timestamp = datetime.now(timezone.utc).isoformat()
     shell_info = {"name": shell.name, "path": shell.path, "prompt": shell.prompt}
+    entries = (
+        {
+            "version": HISTORY_FORMAT_VERSION,
+            "timestamp": timestamp,
+            "log_level": log_level,
+            "shell": shell_info,
+            "command": sanitize_text(command.text),
+            "output": sanitize_text(command.output),
+        }
+        for command in commands
+    )
     try:
-        with HISTORY_PATH.open("a", encoding="utf-8") as f:
-            for command in commands:
-                entry = {
-                    "timestamp": timestamp,
-                    "log_level": log_level,
-                    "shell": shell_info,
-                    "command": sanitize_text(command.text),
-                    "output": sanitize_text(command.output),
-                }
-                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        # Serializing can fail too (e.g. lone surrogates in captured output).
+        payload = b"".join(_dumps(entry) + b"\n" for entry in entries)
+        with HISTORY_PATH.open("ab") as f:
+            f.write(payload)
         _enforce_size_limit(HISTORY_PATH)
     except Exception:
         # Avoid interrupting CLI usage on logging issues
@@ -65,8 +89,7 @@ def read_history(limit: int) -> Tuple[List[Command], Optional[str]]:
     if limit <= 0 or not HISTORY_PATH.exists():
         return [], None
     try:
-        with HISTORY_PATH.open("r", encoding="utf-8") as f:
-            lines = f.readlines()[-limit:]
+        lines = tail_lines(HISTORY_PATH, limit)
     except Exception:
         return [], None
 
@@ -74,9 +97,13 @@ def read_history(limit: int) -> Tuple[List[Command], Optional[str]]:
     last_prompt: Optional[str] = None
     for line in lines:
         try:
-            entry = json.loads(line)
-            command_text = sanitize_text(entry.get("command", ""))
-            output_text = sanitize_text(entry.get("output", ""))
+            entry = _loads(line)
+            command_text = entry.get("command", "")
+            output_text = entry.get("output", "")
+            if "version" not in entry:
+                # Legacy entries may predate sanitization on write.
+                command_text = sanitize_text(command_text)
+                output_text = sanitize_text(output_text)
             commands.append(Command(command_text, output_text))
             if not last_prompt:
                 shell_info = entry.get("shell") or {}
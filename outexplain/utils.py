@@ -2,20 +2,23 @@
 import os
 import re
 import sys
+import json
+import time
+import hashlib
 import platform
+import stat
 import subprocess
 import tempfile
-from dataclasses import dataclass, asdict
-from collections import namedtuple
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from collections import deque, namedtuple
+from pathlib import Path
 from subprocess import check_output, run, CalledProcessError, DEVNULL
-from typing import List, Optional
+from typing import TYPE_CHECKING, Iterator, List, Optional
 
-# Third party
-from ollama import chat
-from psutil import Process, NoSuchProcess
-from openai import OpenAI
-from anthropic import Anthropic
-from rich.markdown import Markdown
+# Third party (provider SDKs and rich are imported where used; they dominate startup time)
+if TYPE_CHECKING:
+    from rich.markdown import Markdown
 
 # Local
 from outexplain.prompts import EXPLAIN_PROMPT, ANSWER_PROMPT
@@ -26,6 +29,19 @@ from outexplain.prompts import EXPLAIN_PROMPT, ANSWER_PROMPT
 MAX_CHARS = int(os.getenv("OUTEXPLAIN_MAX_CHARS", "10000"))
 MAX_COMMANDS_DEFAULT = int(os.getenv("OUTEXPLAIN_MAX_COMMANDS", "3"))
 MAX_HISTORY_LINES = int(os.getenv("OUTEXPLAIN_MAX_HISTORY", "5000"))
+TAIL_CHUNK_SIZE = 64 * 1024
+# Upper bound for login-shell probes; a broken rc file must not hang the CLI.
+SHELL_TIMEOUT = float(os.getenv("OUTEXPLAIN_SHELL_TIMEOUT", "2.0"))
+
+SHELL_CACHE_TTL = int(os.getenv("OUTEXPLAIN_SHELL_CACHE_TTL", "86400"))
+RESPONSE_CACHE_TTL = int(os.getenv("OUTEXPLAIN_CACHE_TTL", "3600"))
+BATCH_CONCURRENCY = int(os.getenv("OUTEXPLAIN_BATCH_CONCURRENCY", "10"))
+
+ANTHROPIC_MODEL = "claude-3-5-sonnet-20241022"
+# Seconds between status checks of an Anthropic Message Batch (OUTEXPLAIN_BATCH=1).
+BATCH_POLL_INTERVAL = float(os.getenv("OUTEXPLAIN_BATCH_POLL_INTERVAL", "5"))
+# Give up waiting after this many seconds; the checkpoint stays so a rerun resumes the batch.
+BATCH_TIMEOUT = float(os.getenv("OUTEXPLAIN_BATCH_TIMEOUT", "900"))
 
 SHELLS = {"bash", "fish", "zsh", "csh", "tcsh", "powershell", "pwsh"}
 
@@ -34,6 +50,13 @@ Command = namedtuple("Command", ["text", "output"])
 
 # Correct ANSI escape pattern (strip control codes)
 ANSI_RE = re.compile(r"\x1b\[[0-9;]*[A-Za-z]")
+# Lines that are only a progress indicator ("45%", "[=====>   ] 12/30 1.2MB/s") and carry little
+# meaning for the LLM. The bar needs a fill character, and only a short numeric counter may
+# follow, so "[ ] todo" checkboxes and "[----------] 3 tests" banners are kept.
+PROGRESS_RE = re.compile(
+    r"^\s*(?:\d{1,3}(?:\.\d+)?%|\[[\s>.-]*[=#][=#>.\s-]*\])"
+    r"(?:\s+[\d.,/:%()]+(?:\s*[kKMG]?i?B(?:/s)?)?){0,3}\s*$"
+)
 SECRET_PATTERNS = [
     re.compile(r"sk-[A-Za-z0-9]{16,}", re.IGNORECASE),
     re.compile(r"api[_-]?key\s*[=:]\s*([A-Za-z0-9._-]{16,})", re.IGNORECASE),
@@ -47,8 +70,53 @@ def count_chars(text: str) -> int:
 def truncate_chars(text: str, reverse: bool = False) -> str:
     return text[-MAX_CHARS:] if reverse else text[:MAX_CHARS]
 
+def tail_lines(path: str | os.PathLike, n: int) -> List[str]:
+    """Return the last ``n`` lines of a file, reading backwards from its end."""
+    if n <= 0:
+        return []
+    chunks: List[bytes] = []
+    newlines = 0
+    with open(path, "rb") as f:
+        pos = f.seek(0, os.SEEK_END)
+        # One extra newline guarantees the oldest kept line is complete.
+        while pos > 0 and newlines <= n:
+            step = min(TAIL_CHUNK_SIZE, pos)
+            pos -= step
+            f.seek(pos)
+            chunk = f.read(step)
+            newlines += chunk.count(b"\n")
+            chunks.append(chunk)
+    # Split the bytes on "\n" only: str.splitlines() would also break JSONL records on
+    # U+2028/U+2029/U+0085, which JSON encoders leave unescaped.
+    lines = b"".join(reversed(chunks)).split(b"\n")
+    if not lines[-1]:
+        lines.pop()
+    return [line.rstrip(b"\r").decode("utf-8", "ignore") for line in lines[-n:]]
+
+def tail_bytes(path: str | os.PathLike, cap: int) -> bytes:
+    """Return at most the last ``cap`` bytes of a file."""
+    if cap <= 0:
+        return b""
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - cap))
+        return f.read()
+
+@lru_cache(maxsize=4096)
 def strip_ansi(s: str) -> str:
-    return ANSI_RE.sub("", s or "")
+    if not s or "\x1b" not in s:
+        return s or ""
+    return ANSI_RE.sub("", s)
+
+def strip_ansi_many(lines: List[str]) -> List[str]:
+    """Strip ANSI codes from many lines with a single regex pass; output stays aligned with input."""
+    if not lines:
+        return []
+    joined = "\n".join(lines)
+    if "\x1b" not in joined:
+        return lines
+    # ANSI_RE never spans a newline, so splitting restores the original line boundaries.
+    return ANSI_RE.sub("", joined).split("\n")
 
 
 def sanitize_text(text: str) -> str:
@@ -58,6 +126,7 @@ def sanitize_text(text: str) -> str:
     return sanitized
 
 # --------------- Shell resolution ---------------
+@lru_cache(maxsize=None)
 def get_shell_name(shell_path: Optional[str] = None) -> Optional[str]:
     if not shell_path:
         return None
@@ -70,26 +139,55 @@ def get_shell_name(shell_path: Optional[str] = None) -> Optional[str]:
         return "pwsh" if base == "pwsh" else "powershell"
     return base if base in SHELLS else None
 
+def _get_psutil():
+    import psutil
+    return psutil
+
+def _walk_parents_linux(pid: int) -> Iterator[tuple[int, str]]:
+    seen: set[int] = set()
+    while pid > 0 and pid not in seen:
+        seen.add(pid)
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                raw = f.read()
+        except OSError:
+            return
+        # Format is "pid (comm) state ppid ..."; comm may itself contain spaces or parens.
+        rparen = raw.rfind(b")")
+        comm = raw[raw.find(b"(") + 1:rparen].decode("utf-8", "replace")
+        yield pid, comm
+        pid = int(raw[rparen + 2:].split()[1])
+
+def _walk_parents(pid: int) -> Iterator[tuple[int, str]]:
+    """Yield ``(pid, name)`` for ``pid`` and each of its ancestors."""
+    if sys.platform.startswith("linux"):
+        yield from _walk_parents_linux(pid)
+        return
+    psutil = _get_psutil()
+    try:
+        proc = psutil.Process(pid)
+        while proc and proc.pid > 0:
+            yield proc.pid, proc.name()
+            proc = proc.parent()
+    except psutil.Error:
+        return
+
 def get_shell_name_and_path() -> tuple[Optional[str], Optional[str]]:
     env_path = os.environ.get("SHELL") or os.environ.get("TF_SHELL")
     if name := get_shell_name(env_path):
         return name, env_path
-    try:
-        proc = Process(os.getpid())
-        while proc and proc.pid > 0:
-            pname = proc.name().lower()
-            if pname.endswith(".exe"):
-                pname = pname[:-4]
-            if pname in SHELLS:
-                return pname, pname
-            proc = proc.parent()
-    except NoSuchProcess:
-        pass
+    for _, pname in _walk_parents(os.getpid()):
+        pname = pname.lower()
+        if pname.endswith(".exe"):
+            pname = pname[:-4]
+        if pname in SHELLS:
+            return pname, pname
     return get_shell_name(env_path), env_path
 
 def _run(cmd: list[str]) -> Optional[str]:
     try:
-        return subprocess.check_output(cmd, text=True, stderr=DEVNULL).rstrip("\n")
+        return subprocess.check_output(cmd, text=True, stdin=DEVNULL, stderr=DEVNULL,
+                                       timeout=SHELL_TIMEOUT).rstrip("\n")
     except Exception:
         return None
 
@@ -108,68 +206,138 @@ def get_shell_prompt(shell_name: Optional[str], shell_path: Optional[str]) -> Op
         return _run([shell_path, "-NoProfile", "-Command", "(& prompt)"])
     return None
 
+# ---------------- Shell cache ----------------
+# Resolving the prompt spawns a login shell, which is slow; reuse the result while the
+# calling shell session, working directory and $SHELL stay the same.
+# Under the user's home rather than the shared temp dir, so nobody else can plant entries.
+CACHE_DIR = Path(os.getenv("XDG_CACHE_HOME") or Path.home() / ".cache") / "outexplain"
+_SHELL_CACHE_PATH = CACHE_DIR / "shell.json"
+
+def _private_dir(path: Path) -> Optional[Path]:
+    """Create ``path`` as a 0700 directory; return it only if the current user owns it."""
+    try:
+        path.mkdir(mode=0o700, parents=True, exist_ok=True)
+        if hasattr(os, "getuid"):
+            st = os.lstat(path)
+            if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid():
+                return None
+            if st.st_mode & 0o077:
+                os.chmod(path, 0o700)
+    except OSError:
+        return None
+    return path
+
+def _shell_cache_key() -> Optional[list]:
+    try:
+        cwd = os.getcwd()
+    except OSError:
+        # Working directory was deleted under us; resolve without the cache.
+        return None
+    return [os.getenv("SHELL"), os.getenv("TF_SHELL"), cwd, os.getppid()]
+
+def _load_shell_cache() -> dict:
+    key = _shell_cache_key()
+    if key is None or _private_dir(_SHELL_CACHE_PATH.parent) is None:
+        return {}
+    try:
+        with open(_SHELL_CACHE_PATH, "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if not isinstance(data, dict) or data.get("key") != key:
+        return {}
+    if time.time() - data.get("time", 0) > SHELL_CACHE_TTL:
+        return {}
+    return data
+
+def _atomic_write_text(path: Path, text: str) -> None:
+    """Write via a sibling temp file so concurrent readers never see a partial file."""
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", dir=path.parent,
+                                     prefix=f".{path.name}.", delete=False) as f:
+        f.write(text)
+    os.replace(f.name, path)
+
+def _store_shell_cache(**values) -> None:
+    key = _shell_cache_key()
+    if key is None or _private_dir(_SHELL_CACHE_PATH.parent) is None:
+        return
+    data = _load_shell_cache() or {"key": key, "time": time.time()}
+    data.update(values)
+    try:
+        _atomic_write_text(_SHELL_CACHE_PATH, json.dumps(data))
+    except OSError:
+        pass
+
 # ---------------- Pane / Output IO ----------------
 def get_pane_output() -> str:
     """Capture text from the current tmux/screen pane."""
-    output_file = None
     try:
-        with tempfile.NamedTemporaryFile(delete=False, mode="w+") as temp_file:
-            output_file = temp_file.name
         if os.getenv("TMUX"):
             cmd = ["tmux", "capture-pane", "-p", "-S", f"-{MAX_HISTORY_LINES}"]
-            with open(output_file, "w", encoding="utf-8", errors="replace") as f:
-                run(cmd, stdout=f, text=True)
-        elif os.getenv("STY"):
-            cmd = ["screen", "-X", "hardcopy", "-h", output_file]
-            check_output(cmd, text=True)
-        else:
-            return ""
-        with open(output_file, "r", encoding="utf-8", errors="replace") as f:
-            return f.read()
-    except CalledProcessError:
+            return run(cmd, capture_output=True, text=True, errors="replace", check=False).stdout
+        if os.getenv("STY"):
+            # screen can only dump its scrollback to a file.
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                output_file = os.path.join(tmp_dir, "hardcopy")
+                check_output(["screen", "-X", "hardcopy", "-h", output_file], text=True)
+                with open(output_file, "r", encoding="utf-8", errors="replace") as f:
+                    return f.read()
+        return ""
+    except (CalledProcessError, OSError):
         return ""
-    finally:
-        if output_file and os.path.exists(output_file):
-            try:
-                os.remove(output_file)
-            except Exception:
-                pass
 
 # ---------------- Parsing commands ----------------
+def _ends_like_prompt(s: str) -> bool:
+    s = s.rstrip()
+    return bool(s) and s[-1] in "$#>"
+
 def looks_like_command_line(line: str) -> bool:
-    s = strip_ansi(line).rstrip()
-    return bool(s) and (s.endswith("$") or s.endswith("#") or s.endswith(">"))
+    return _ends_like_prompt(strip_ansi(line))
 
 def get_commands(pane_output: str, shell: Shell, max_commands: Optional[int] = None) -> List[Command]:
-    commands: List[Command] = []
-    buffer: List[str] = []
-    prompt_raw = (shell.prompt or "").strip()
-    prompt_cmp = strip_ansi(prompt_raw)
+    # Filled back to front with appendleft, so both end up in display order.
+    commands: deque[Command] = deque()
+    buffer: deque[str] = deque()
+    prompt_cmp = strip_ansi((shell.prompt or "").strip())
+    prompt_len = len(prompt_cmp)
     cap = max_commands if (isinstance(max_commands, int) and max_commands > 0) else None
-    for raw in reversed(pane_output.splitlines()):
-        line = raw.rstrip("\n")
+    lines = pane_output.splitlines()
+    # Walk backwards so we can stop as soon as `cap` commands have been found.
+    # With a cap only the visited tail needs stripping, so strip lazily per line.
+    if cap:
+        cleaned = map(strip_ansi, reversed(lines))
+    else:
+        cleaned = reversed(strip_ansi_many(lines))
+    for line, line_cmp in zip(reversed(lines), cleaned):
         if not line.strip():
             continue
-        line_cmp = strip_ansi(line)
         is_prompt_line, cmd_text = False, ""
-        if prompt_cmp and prompt_cmp in line_cmp:
-            parts = line_cmp.rsplit(prompt_cmp, 1)
-            if len(parts) == 2:
-                cmd_text = parts[1].strip()
-                is_prompt_line = True
-        elif looks_like_command_line(line_cmp):
+        idx = line_cmp.rfind(prompt_cmp) if prompt_cmp else -1
+        if idx != -1:
+            cmd_text = line_cmp[idx + prompt_len:].strip()
+            is_prompt_line = True
+        elif _ends_like_prompt(line_cmp):
             cmd_text = line_cmp.split()[-1] if " " in line_cmp else line_cmp
             is_prompt_line = True
         if is_prompt_line:
-            command = Command(cmd_text, "\n".join(reversed(buffer)).strip())
-            commands.append(command)
+            command = Command(cmd_text, "\n".join(buffer).strip())
+            commands.appendleft(command)
             buffer.clear()
             if cap and len(commands) >= cap:
                 break
             continue
-        buffer.append(line)
-    filtered = [c for c in commands if not c.text.startswith("outexplain")]
-    return list(reversed(filtered))
+        buffer.appendleft(line)
+    return [c for c in commands if not c.text.startswith("outexplain")]
+
+def _tail_whole_lines(text: str, budget: int) -> str:
+    """Return the longest suffix of ``text`` within ``budget`` chars that starts on a line boundary."""
+    cut = len(text) - max(budget, 0)
+    if cut <= 0:
+        return text
+    if text[cut - 1] != "\n":
+        newline = text.find("\n", cut)
+        cut = newline + 1 if newline != -1 else len(text)
+    return text[cut:]
 
 def truncate_commands(commands: List[Command], max_commands: Optional[int] = None) -> List[Command]:
     cap = max_commands if (isinstance(max_commands, int) and max_commands > 0) else None
@@ -180,56 +348,116 @@ def truncate_commands(commands: List[Command], max_commands: Optional[int] = Non
         if cchars + num_chars > MAX_CHARS:
             break
         num_chars += cchars
-        out_lines = []
-        for line in reversed(command.output.splitlines()):
-            lchars = count_chars(line)
-            if lchars + num_chars > MAX_CHARS:
-                break
-            out_lines.append(line)
-            num_chars += lchars
-        output = "\n".join(reversed(out_lines))
+        # Collapse first so the budget goes to lines that carry meaning, not progress spam.
+        output = _tail_whole_lines(_collapse_repeats(command.output), MAX_CHARS - num_chars)
+        num_chars += count_chars(output)
         truncated.append(Command(command.text, output))
     return truncated
 
 def truncate_pane_output(output: str) -> str:
-    hit_non_empty = False
-    lines: List[str] = []
-    for line in reversed(output.splitlines()):
-        if line and line.strip():
-            hit_non_empty = True
-        if hit_non_empty:
-            lines.append(line)
-    if lines:
-        lines = lines[1:]  # drop invocation line
-    output = "\n".join(reversed(lines))
+    # Only the last MAX_CHARS survive; keep some slack for trailing blank lines.
+    lines = output[-(MAX_CHARS * 4):].splitlines()
+    end = len(lines)
+    while end and not lines[end - 1].strip():
+        end -= 1
+    output = "\n".join(lines[:max(end - 1, 0)])  # drop invocation line
     return truncate_chars(output, reverse=True).strip()
 
+def _collapse_repeats(text: str, max_run: int = 3) -> str:
+    """Shrink runs of identical lines and progress-bar lines to keep the LLM input small."""
+    lines = text.split("\n")
+    out: List[str] = []
+    i, n = 0, len(lines)
+    while i < n:
+        line, j = lines[i], i + 1
+        if PROGRESS_RE.match(line):
+            while j < n and PROGRESS_RE.match(lines[j]):
+                j += 1
+            if j - i > 1:
+                out.append(f"... ({j - i - 1} progress lines omitted)")
+            out.append(lines[j - 1])
+        else:
+            while j < n and lines[j] == line:
+                j += 1
+            out.extend(lines[i:min(j, i + max_run)])
+            if j - i > max_run:
+                out.append(f"... ({j - i - max_run} more identical lines)")
+        i = j
+    return "\n".join(out)
+
 def command_to_string(command: Command, shell_prompt: Optional[str] = None) -> str:
     shell_prompt = shell_prompt if shell_prompt else "$"
-    command_str = f"{shell_prompt} {command.text}"
     output = command.output.strip()
-    if output:
-        command_str += f"\n{output}"
-    else:
-        command_str += "\n(output missing)"
-    return command_str
+    return f"{shell_prompt} {command.text}\n{output or '(output missing)'}"
 
-def format_output(output: str) -> Markdown:
+def format_output(output: str) -> "Markdown":
+    from rich.markdown import Markdown
     return Markdown(output, code_theme="monokai",
                     inline_code_lexer="python", inline_code_theme="monokai")
 
 # ---------------- LLM provider runners ----------------
+def _anthropic_params(system_message: str, user_message: str) -> dict:
+    return {
+        "model": ANTHROPIC_MODEL,
+        "max_tokens": 1024,
+        "system": system_message,
+        "messages": [{"role": "user", "content": user_message}],
+    }
+
+def _run_anthropic_message_batch(anthropic, params: dict) -> str:
+    """Submit ``params`` through the Message Batches API (half price, minutes of latency).
+
+    The batch id is checkpointed on disk, so a rerun after a crash resumes the pending
+    batch instead of paying for a new one.
+    """
+    custom_id = hashlib.blake2b(json.dumps(params, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+    cache_dir = _private_dir(_RESPONSE_CACHE_DIR)
+    checkpoint = cache_dir / f"batch-{custom_id}.json" if cache_dir else None
+    batch = None
+    if checkpoint is not None and checkpoint.exists():
+        try:
+            batch = anthropic.messages.batches.retrieve(json.loads(checkpoint.read_text(encoding="utf-8"))["batch_id"])
+        except Exception:
+            # Unreadable checkpoint or unknown/expired batch id: start a new batch.
+            batch = None
+    if batch is None:
+        batch = anthropic.messages.batches.create(requests=[{"custom_id": custom_id, "params": params}])
+        if checkpoint is not None:
+            try:
+                _atomic_write_text(checkpoint, json.dumps({"batch_id": batch.id}))
+            except OSError:
+                pass
+    deadline = time.monotonic() + BATCH_TIMEOUT
+    while batch.processing_status != "ended":
+        if time.monotonic() >= deadline:
+            raise RuntimeError(f"Anthropic batch {batch.id} is still pending after {BATCH_TIMEOUT:g}s; "
+                               "rerun the same command to resume waiting for it.")
+        time.sleep(BATCH_POLL_INTERVAL)
+        batch = anthropic.messages.batches.retrieve(batch.id)
+    for entry in anthropic.messages.batches.results(batch.id):
+        if entry.custom_id != custom_id:
+            continue
+        if checkpoint is not None:
+            try:
+                checkpoint.unlink()
+            except OSError:
+                pass
+        if entry.result.type != "succeeded":
+            raise RuntimeError(f"Anthropic batch request {entry.result.type}.")
+        return entry.result.message.content[0].text
+    raise RuntimeError("Anthropic batch finished without a result.")
+
 def run_anthropic(system_message: str, user_message: str) -> str:
+    from anthropic import Anthropic
     anthropic = Anthropic()
-    response = anthropic.messages.create(
-        model="claude-3-5-sonnet-20241022",
-        max_tokens=1024,
-        system=system_message,
-        messages=[{"role": "user", "content": user_message}],
-    )
+    params = _anthropic_params(system_message, user_message)
+    if _bool_env("OUTEXPLAIN_BATCH"):
+        return _run_anthropic_message_batch(anthropic, params)
+    response = anthropic.messages.create(**params)
     return response.content[0].text
 
 def run_openai(system_message: str, user_message: str, model: Optional[str] = None) -> str:
+    from openai import OpenAI
     openai = OpenAI(base_url=os.getenv("OPENAI_BASE_URL") or None)
     response = openai.chat.completions.create(
         messages=[
@@ -243,6 +471,7 @@ def run_openai(system_message: str, user_message: str, model: Optional[str] = No
     return response.choices[0].message.content
 
 def run_ollama(system_message: str, user_message: str, model: Optional[str] = None) -> str:
+    from ollama import chat
     response = chat(
         model=model or os.getenv("OLLAMA_MODEL"),
         messages=[
@@ -252,6 +481,45 @@ def run_ollama(system_message: str, user_message: str, model: Optional[str] = No
     )
     return response.message.content
 
+def stream_anthropic(system_message: str, user_message: str) -> Iterator[str]:
+    from anthropic import Anthropic
+    anthropic = Anthropic()
+    with anthropic.messages.stream(**_anthropic_params(system_message, user_message)) as stream:
+        yield from stream.text_stream
+
+def stream_openai(system_message: str, user_message: str, model: Optional[str] = None) -> Iterator[str]:
+    from openai import OpenAI
+    openai = OpenAI(base_url=os.getenv("OPENAI_BASE_URL") or None)
+    response = openai.chat.completions.create(
+        messages=[
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_message},
+        ],
+        model=model or os.getenv("OPENAI_MODEL") or "gpt-4o",
+        temperature=0.2,
+        max_tokens=1200,
+        stream=True,
+    )
+    for chunk in response:
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def stream_ollama(system_message: str, user_message: str, model: Optional[str] = None) -> Iterator[str]:
+    from ollama import chat
+    response = chat(
+        model=model or os.getenv("OLLAMA_MODEL"),
+        messages=[
+            {"role": "system", "content": system_message},
+            {"role": "user", "content": user_message},
+        ],
+        stream=True,
+    )
+    for part in response:
+        if part.message.content:
+            yield part.message.content
+
+# Provider keys don't change within a run; batch/explain paths call this repeatedly.
+@lru_cache(maxsize=1)
 def get_llm_provider() -> str:
     if os.getenv("OPENAI_API_KEY"):
         return "openai"
@@ -287,6 +555,7 @@ def _bool_env(name: str) -> bool:
     v = os.getenv(name)
     return v not in (None, "", "0", "false", "False")
 
+@lru_cache(maxsize=None)
 def _detect_color_depth(term: str | None) -> int:
     colorterm = (os.getenv("COLORTERM") or "").lower()
     if colorterm in {"truecolor", "24bit"}:
@@ -297,6 +566,7 @@ def _detect_color_depth(term: str | None) -> int:
         return 24
     return 16
 
+@lru_cache(maxsize=None)
 def _detect_hyperlinks(term: str | None) -> bool:
     if os.getenv("WT_SESSION"):
         return True
@@ -317,23 +587,33 @@ def _detect_hyperlinks(term: str | None) -> bool:
         return True
     return False
 
+@lru_cache(maxsize=None)
 def _detect_emoji_support() -> bool:
     if os.getenv("WT_SESSION"):
         return True
     sysname = platform.system()
     return sysname in {"Darwin", "Linux", "Windows"}
 
+# The parent chain is stable within a single run; (timestamp, chain) of the last lookup.
+_PARENT_CHAIN_TTL = 1.0
+_parent_chain_memo: Optional[tuple[float, list[str]]] = None
+
 def _get_parent_chain() -> list[str]:
-    names: list[str] = []
-    try:
-        proc = Process(os.getpid())
-        while proc and proc.pid > 0:
-            names.append(proc.name())
-            proc = proc.parent()
-    except Exception:
-        pass
-    return names
+    global _parent_chain_memo
+    if _parent_chain_memo and time.monotonic() - _parent_chain_memo[0] < _PARENT_CHAIN_TTL:
+        return list(_parent_chain_memo[1])
+    names = _load_shell_cache().get("parent_chain")
+    if not isinstance(names, list):
+        names = []
+        try:
+            names = [name for _, name in _walk_parents(os.getpid())]
+        except Exception:
+            pass
+        _store_shell_cache(parent_chain=names)
+    _parent_chain_memo = (time.monotonic(), names)
+    return list(names)
 
+@lru_cache(maxsize=None)
 def _guess_emulator_from_env() -> str | None:
     if os.getenv("WT_SESSION"):
         return "WindowsTerminal"
@@ -347,16 +627,19 @@ def _guess_emulator_from_env() -> str | None:
         return "xterm"
     return None
 
+# Emulator/host process names in priority order.
+_EMULATOR_CANDIDATES = ("windowsterminal", "wezterm", "iterm2", "alacritty",
+                        "hyper", "kitty", "gnome-terminal", "konsole", "xterm",
+                        "terminator", "tilix", "tmux", "screen", "conhost",
+                        "powershell", "pwsh", "cmd", "code")
+
 def _guess_emulator_from_process_chain(chain: list[str]) -> str | None:
-    low = [n.lower() for n in chain]
-    candidates = ["windowsterminal", "wezterm", "iterm2", "alacritty",
-                  "hyper", "kitty", "gnome-terminal", "konsole", "xterm",
-                  "terminator", "tilix", "tmux", "screen", "conhost",
-                  "powershell", "pwsh", "cmd", "code"]
-    for cand in candidates:
-        for n in low:
-            if cand in n:
-                return cand
+    # One lowered haystack: each candidate is a single C-level substring search.
+    # The separator can't occur in a process name, so matches never span two entries.
+    haystack = "\0".join(chain).lower()
+    for cand in _EMULATOR_CANDIDATES:
+        if cand in haystack:
+            return cand
     return None
 
 def detect_terminal_info(shell: Shell) -> TerminalInfo:
@@ -389,7 +672,8 @@ def detect_terminal_info(shell: Shell) -> TerminalInfo:
 
 def format_terminal_info(info: TerminalInfo) -> str:
     lines = []
-    data = asdict(info)
+    # Shallow read of each field; asdict() would deep-copy parent_chain just to print it.
+    data = {f.name: getattr(info, f.name) for f in fields(info)}
     chain = data.pop("parent_chain", [])
     data["parent_chain"] = " > ".join(chain[:8]) + (" > …" if len(chain) > 8 else "")
     for k, v in data.items():
@@ -401,14 +685,23 @@ def choose_symbols(info: TerminalInfo) -> dict[str, str]:
         {"ok": "[OK]", "warn": "[!]", "fail": "[X]", "info": "[i]"}
 
 def get_shell() -> Shell:
+    cached = _load_shell_cache().get("shell")
+    if isinstance(cached, list) and len(cached) == 3:
+        return Shell(*cached)
     name, path = get_shell_name_and_path()
     prompt = get_shell_prompt(name, path)
-    return Shell(path, name, prompt)
+    shell = Shell(path, name, prompt)
+    if prompt is not None:
+        # A failed or timed-out probe is retried next run rather than pinned for a day.
+        _store_shell_cache(shell=list(shell))
+    return shell
 
 def get_terminal_context(
-    shell: Shell, max_commands: Optional[int] = None, return_commands: bool = False
+    shell: Shell, max_commands: Optional[int] = None, return_commands: bool = False,
+    pane_output: Optional[str] = None,
 ):
-    pane_output = get_pane_output()
+    if pane_output is None:
+        pane_output = get_pane_output()
     if not pane_output and not sys.stdin.isatty():
         try:
             pane_output = sys.stdin.read()
@@ -432,27 +725,177 @@ def build_context_from_commands(commands: List[Command], shell_prompt: Optional[
     if not commands:
         return "<terminal_history>No terminal output found.</terminal_history>"
     previous_commands, last_command = commands[:-1], commands[-1]
-    context = "<terminal_history>\n"
-    context += "<previous_commands>\n"
-    context += "\n".join(command_to_string(c, shell_prompt) for c in previous_commands)
-    context += "\n</previous_commands>\n"
-    context += "\n<last_command>\n"
-    context += command_to_string(last_command, shell_prompt)
-    context += "\n</last_command>\n"
-    context += "</terminal_history>"
-    return context
+    return "".join([
+        "<terminal_history>\n<previous_commands>\n",
+        "\n".join(command_to_string(c, shell_prompt) for c in previous_commands),
+        "\n</previous_commands>\n\n<last_command>\n",
+        command_to_string(last_command, shell_prompt),
+        "\n</last_command>\n</terminal_history>",
+    ])
 
 def build_query(context: str, query: Optional[str] = None) -> str:
     if not (query and query.strip()):
         query = "Explain the last command's output. Use previous commands as context, but focus on the last command."
     return f"{sanitize_text(context)}\n\n{sanitize_text(query)}"
 
-def explain(context: str, query: Optional[str] = None, provider: Optional[str] = None, model: Optional[str] = None) -> Markdown:
+# ---------------- Response cache ----------------
+# Re-running outexplain on the same output is common; answer it from disk instead of the LLM.
+# Responses quote terminal output, so they live in the private per-user cache dir.
+_RESPONSE_CACHE_DIR = CACHE_DIR / "responses"
+
+def _response_cache_path(provider_name: str, model: Optional[str], system_message: str, user_message: str) -> Path:
+    key = "|".join([
+        provider_name,
+        model or "",
+        os.getenv("OPENAI_MODEL") or "",
+        os.getenv("OPENAI_BASE_URL") or "",
+        os.getenv("OLLAMA_MODEL") or "",
+        system_message,
+        user_message,
+    ])
+    digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+    return _RESPONSE_CACHE_DIR / f"{digest}.md"
+
+def _read_cached_response(path: Path) -> Optional[str]:
+    if RESPONSE_CACHE_TTL <= 0 or _private_dir(path.parent) is None:
+        return None
+    try:
+        if time.time() - path.stat().st_mtime > RESPONSE_CACHE_TTL:
+            path.unlink()
+            return None
+        return path.read_text(encoding="utf-8")
+    except OSError:
+        return None
+
+def _write_cached_response(path: Path, response: str) -> None:
+    if RESPONSE_CACHE_TTL <= 0 or not response:
+        return
+    if _private_dir(path.parent) is None:
+        return
+    try:
+        _atomic_write_text(path, response)
+    except OSError:
+        pass
+
+def build_messages(context: str, query: Optional[str] = None) -> tuple[str, str]:
     system_message = EXPLAIN_PROMPT if not query else ANSWER_PROMPT
-    user_message = build_query(context, query)
+    return system_message, build_query(context, query)
+
+def explain(context: str, query: Optional[str] = None, provider: Optional[str] = None, model: Optional[str] = None) -> "Markdown":
+    system_message, user_message = build_messages(context, query)
+    provider_name = provider or get_llm_provider()
+    cache_path = _response_cache_path(provider_name, model, system_message, user_message)
+    response = _read_cached_response(cache_path)
+    if response is None:
+        if provider_name == "anthropic":
+            response = run_anthropic(system_message, user_message)
+        elif provider_name == "ollama":
+            response = run_ollama(system_message, user_message, model=model)
+        else:
+            response = run_openai(system_message, user_message, model=model)
+        _write_cached_response(cache_path, response)
+    return format_output(response)
+
+def stream_explanation(context: str, query: Optional[str] = None, provider: Optional[str] = None,
+                       model: Optional[str] = None) -> Iterator[str]:
+    """Like :func:`explain`, but yield the raw Markdown as the provider produces it."""
+    system_message, user_message = build_messages(context, query)
     provider_name = provider or get_llm_provider()
+    cache_path = _response_cache_path(provider_name, model, system_message, user_message)
+    cached = _read_cached_response(cache_path)
+    if cached is not None:
+        yield cached
+        return
+    if provider_name == "anthropic" and _bool_env("OUTEXPLAIN_BATCH"):
+        # Batched requests cannot stream; the answer arrives in one piece.
+        chunks = iter([run_anthropic(system_message, user_message)])
+    elif provider_name == "anthropic":
+        chunks = stream_anthropic(system_message, user_message)
+    elif provider_name == "ollama":
+        chunks = stream_ollama(system_message, user_message, model=model)
+    else:
+        chunks = stream_openai(system_message, user_message, model=model)
+    parts: List[str] = []
+    for chunk in chunks:
+        parts.append(chunk)
+        yield chunk
+    # Only reached when the response was consumed in full.
+    _write_cached_response(cache_path, "".join(parts))
+
+
+# ---------------- Batch explain ----------------
+def _chat_messages(system_message: str, user_message: str) -> list[dict[str, str]]:
+    return [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": user_message},
+    ]
+
+def _async_runner(provider_name: str, model: Optional[str]):
+    """Return ``(call, client)``: a coroutine function and the async client it shares."""
     if provider_name == "anthropic":
-        return format_output(run_anthropic(system_message, user_message))
+        from anthropic import AsyncAnthropic
+        client = AsyncAnthropic()
+
+        async def call(system_message: str, user_message: str) -> str:
+            response = await client.messages.create(**_anthropic_params(system_message, user_message))
+            return response.content[0].text
+        return call, client
+
     if provider_name == "ollama":
-        return format_output(run_ollama(system_message, user_message, model=model))
-    return format_output(run_openai(system_message, user_message, model=model))
+        from ollama import AsyncClient
+        client = AsyncClient()
+
+        async def call(system_message: str, user_message: str) -> str:
+            response = await client.chat(model=model or os.getenv("OLLAMA_MODEL"),
+                                         messages=_chat_messages(system_message, user_message))
+            return response.message.content
+        return call, client
+
+    from openai import AsyncOpenAI
+    client = AsyncOpenAI(base_url=os.getenv("OPENAI_BASE_URL") or None)
+
+    async def call(system_message: str, user_message: str) -> str:
+        response = await client.chat.completions.create(
+            messages=_chat_messages(system_message, user_message),
+            model=model or os.getenv("OPENAI_MODEL") or "gpt-4o",
+            temperature=0.2,
+            max_tokens=1200,
+        )
+        return response.choices[0].message.content
+    return call, client
+
+async def _explain_batch_async(items: List[tuple[str, Optional[str]]], provider_name: str,
+                               model: Optional[str], concurrency: int) -> List[str]:
+    import asyncio
+    call, client = _async_runner(provider_name, model)
+    semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+    async def one(context: str, query: Optional[str]) -> str:
+        system_message, user_message = build_messages(context, query)
+        cache_path = _response_cache_path(provider_name, model, system_message, user_message)
+        cached = _read_cached_response(cache_path)
+        if cached is not None:
+            return cached
+        async with semaphore:
+            response = await call(system_message, user_message)
+        _write_cached_response(cache_path, response)
+        return response
+
+    try:
+        return await asyncio.gather(*(one(context, query) for context, query in items))
+    finally:
+        # Older ollama clients have no close().
+        close = getattr(client, "close", None)
+        if close is not None:
+            await close()
+
+def explain_batch(contexts_and_queries: List[tuple[str, Optional[str]]], provider: Optional[str] = None,
+                  model: Optional[str] = None, concurrency: int = BATCH_CONCURRENCY) -> List["Markdown"]:
+    """Explain several (context, query) pairs concurrently, sharing one client per provider."""
+    if not contexts_and_queries:
+        return []
+    # Only --batch needs an event loop; importing asyncio costs every other run ~15 ms.
+    import asyncio
+    provider_name = provider or get_llm_provider()
+    responses = asyncio.run(_explain_batch_async(contexts_and_queries, provider_name, model, concurrency))
+    return [format_output(response) for response in responses]
@@ -24,7 +24,7 @@ setup(
     },
     install_requires=[
         "openai>=1.30",
-        "anthropic>=0.34",
+        "anthropic>=0.41",
         "ollama>=0.3",
         "rich>=13.7",
         "psutil>=5.9",
@@ -0,0 +1,90 @@
+import os
+import threading
+
+import pytest
+
+from outexplain import daemon
+
+pytestmark = pytest.mark.skipif(not daemon.available(), reason="needs Unix domain sockets")
+
+
+@pytest.fixture
+def running_daemon(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    monkeypatch.setattr(daemon._Server, "timeout", 0.2)
+    monkeypatch.setattr(daemon, "_spawn", lambda: None)
+    monkeypatch.setattr(daemon, "_warm_imports", lambda: None)
+    umask = os.umask(0o022)
+    thread = threading.Thread(target=daemon.serve, daemon=True)
+    thread.start()
+    yield
+    thread.join(timeout=5)
+    os.umask(umask)
+    assert not thread.is_alive()
+    assert not os.path.exists(daemon.socket_path())
+
+
+def test_stream_via_daemon_relays_chunks(monkeypatch, running_daemon):
+    seen = {}
+
+    def fake_stream(context, query=None, provider=None, model=None):
+        seen.update(context=context, query=query, provider=provider)
+        yield "## Cause\n"
+        yield "Missing file — ✓"
+
+    monkeypatch.setattr(daemon, "stream_explanation", fake_stream)
+    chunks = daemon.stream_via_daemon("ctx", "why?", provider="ollama")
+    assert "".join(chunks) == "## Cause\nMissing file — ✓"
+    assert seen == {"context": "ctx", "query": "why?", "provider": "ollama"}
+
+
+def test_stream_via_daemon_surfaces_errors(monkeypatch, running_daemon):
+    def failing_stream(context, query=None, provider=None, model=None):
+        raise ValueError("No model configured.")
+        yield
+
+    monkeypatch.setattr(daemon, "stream_explanation", failing_stream)
+    with pytest.raises(RuntimeError, match="No model configured."):
+        daemon.stream_via_daemon("ctx", provider="openai")
+
+
+def test_stream_via_daemon_flags_answer_cut_short(monkeypatch, running_daemon):
+    def flaky_stream(context, query=None, provider=None, model=None):
+        yield "partial"
+        raise ConnectionError("provider dropped")
+
+    monkeypatch.setattr(daemon, "stream_explanation", flaky_stream)
+    chunks = daemon.stream_via_daemon("ctx", provider="openai")
+    assert next(chunks) == "partial"
+    with pytest.raises(RuntimeError, match="provider dropped"):
+        next(chunks)
+
+
+def test_socket_path_refuses_directory_owned_by_someone_else(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    path = daemon.socket_path()
+    assert path.startswith(str(tmp_path / "outexplain" / "daemon-"))
+    assert (tmp_path / "outexplain").stat().st_mode & 0o777 == 0o700
+    monkeypatch.setattr(os, "getuid", lambda: os.stat(tmp_path).st_uid + 1)
+    assert daemon.socket_path() is None
+
+
+def test_stream_via_daemon_resolves_provider_in_caller(monkeypatch, running_daemon):
+    seen = {}
+
+    def fake_stream(context, query=None, provider=None, model=None):
+        seen["provider"] = provider
+        yield "ok"
+
+    monkeypatch.setattr(daemon, "stream_explanation", fake_stream)
+    monkeypatch.setattr(daemon, "get_llm_provider", lambda: "ollama")
+    assert "".join(daemon.stream_via_daemon("ctx")) == "ok"
+    assert seen == {"provider": "ollama"}
+
+
+def test_worker_is_chosen_by_provider_configuration(monkeypatch, tmp_path):
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(tmp_path))
+    monkeypatch.setenv("OPENAI_MODEL", "gpt-4o")
+    first = daemon.socket_path()
+    monkeypatch.setenv("OPENAI_MODEL", "gpt-4o-mini")
+    assert daemon.socket_path() != first
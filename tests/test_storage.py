@@ -0,0 +1,76 @@
+import pytest
+
+from outexplain import storage
+from outexplain.utils import Command
+
+
+def _use_history(monkeypatch, tmp_path, max_bytes=1048576):
+    path = tmp_path / "history.jsonl"
+    monkeypatch.setattr(storage, "HISTORY_PATH", path)
+    monkeypatch.setattr(storage, "MAX_HISTORY_BYTES", max_bytes)
+    return path
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_append_and_read_history_roundtrip(monkeypatch, tmp_path, bash_shell, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(storage, "orjson", None)
+    elif storage.orjson is None:
+        pytest.skip("orjson not installed")
+    _use_history(monkeypatch, tmp_path)
+    storage.append_history([Command("ls", "a.txt"), Command("pwd", "/tmp")], bash_shell)
+    storage.append_history([Command("echo hi", "hi")], bash_shell)
+
+    commands, prompt = storage.read_history(2)
+    assert [cmd.text for cmd in commands] == ["pwd", "echo hi"]
+    assert commands[1].output == "hi"
+    assert prompt == "$"
+
+
+def test_append_history_rotates_past_high_watermark(monkeypatch, tmp_path, bash_shell):
+    path = _use_history(monkeypatch, tmp_path, max_bytes=1000)
+    for i in range(40):
+        storage.append_history([Command(f"echo {i}", str(i))], bash_shell)
+
+    assert path.stat().st_size <= 1000 * storage.HISTORY_ROTATE_RATIO
+    commands, _ = storage.read_history(1)
+    assert commands == [Command("echo 39", "39")]
+
+
+def test_enforce_size_limit_keeps_entry_starting_at_cut(monkeypatch, tmp_path):
+    path = _use_history(monkeypatch, tmp_path, max_bytes=10)
+    path.write_bytes(b"0123456789\n" + b"abc\n" + b"efghi\n")
+    storage._enforce_size_limit(path)
+    assert path.read_bytes() == b"abc\nefghi\n"
+
+    path.write_bytes(b"0123456789\n" + b"abcde\n" + b"fghij\n")
+    storage._enforce_size_limit(path)
+    assert path.read_bytes() == b"fghij\n"
+
+
+def test_read_history_sanitizes_legacy_entries(monkeypatch, tmp_path):
+    path = _use_history(monkeypatch, tmp_path)
+    path.write_text(
+        '{"command": "export API_KEY=abcdefghijklmnopqrstuvwxyz", "output": ""}\n',
+        encoding="utf-8",
+    )
+    commands, _ = storage.read_history(1)
+    assert commands[0].text == "export [REDACTED]"
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_append_history_survives_unencodable_output(monkeypatch, tmp_path, bash_shell, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr(storage, "orjson", None)
+    elif storage.orjson is None:
+        pytest.skip("orjson not installed")
+    path = _use_history(monkeypatch, tmp_path)
+    storage.append_history([Command("cat blob", "bad \udcff byte")], bash_shell)
+    assert not path.exists() or path.read_bytes() == b""
+
+
+def test_read_history_keeps_entries_with_unicode_line_separators(monkeypatch, tmp_path, bash_shell):
+    _use_history(monkeypatch, tmp_path)
+    storage.append_history([Command("ls", "a\u2028b\x85c"), Command("pwd", "/tmp")], bash_shell)
+    commands, _ = storage.read_history(2)
+    assert [cmd.output for cmd in commands] == ["a\u2028b\x85c", "/tmp"]
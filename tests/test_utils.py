@@ -1,12 +1,19 @@
+import asyncio
+import os
+
 import pytest
 
-from outexplain import outexplain
+from outexplain import outexplain, utils
 from outexplain.utils import (
     Command,
+    Shell,
+    build_context_from_commands,
     build_query,
     get_commands,
     get_llm_provider,
+    tail_lines,
     truncate_commands,
+    truncate_pane_output,
 )
 
 
@@ -45,10 +52,21 @@ def test_truncate_commands_respects_max_chars(monkeypatch):
 def test_get_llm_provider_raises_without_env(monkeypatch):
     for key in ("OPENAI_API_KEY", "ANTHROPIC_API_KEY", "OLLAMA_MODEL"):
         monkeypatch.delenv(key, raising=False)
+    get_llm_provider.cache_clear()
     with pytest.raises(ValueError):
         get_llm_provider()
 
 
+def test_get_llm_provider_is_resolved_once(monkeypatch):
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    monkeypatch.setenv("ANTHROPIC_API_KEY", "test")
+    get_llm_provider.cache_clear()
+    assert get_llm_provider() == "anthropic"
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    assert get_llm_provider() == "anthropic"
+    get_llm_provider.cache_clear()
+
+
 def test_build_query_combines_messages(monkeypatch):
     context = "<terminal_history>example</terminal_history>"
     combined = outexplain.combine_user_messages(["First message", "Second"], summary=False)
@@ -60,3 +78,284 @@ def test_build_query_combines_messages(monkeypatch):
     query = outexplain.combine_user_messages([""], summary=False)
     assert query == ""
     assert build_query(context, query) == f"{context}\n\nExplain the last command's output. Use previous commands as context, but focus on the last command."
+
+
+def test_read_commands_from_ps_transcript_prefers_newest(monkeypatch, tmp_path):
+    docs = tmp_path / "Documents"
+    docs.mkdir()
+    old = docs / "PowerShell_transcript.old.txt"
+    new = docs / "PowerShell_transcript.new.txt"
+    old.write_text("PS C:\\> dir\nold output\n", encoding="utf-8")
+    new.write_text("PS C:\\> Get-Date\nnew output\n", encoding="utf-8")
+    os.utime(old, (1, 1))
+    (docs / "notes.txt").write_text("> ignored\n", encoding="utf-8")
+    monkeypatch.setattr(outexplain.Path, "home", lambda: tmp_path)
+    commands, missing_output = outexplain._read_commands_from_ps_transcript(max_count=3)
+    assert not missing_output
+    assert [cmd.text for cmd in commands] == ["Get-Date"]
+    assert commands[0].output == "new output"
+
+
+def test_tail_lines_reads_across_chunks(monkeypatch, tmp_path):
+    monkeypatch.setattr("outexplain.utils.TAIL_CHUNK_SIZE", 8)
+    path = tmp_path / "history.txt"
+    path.write_text("".join(f"line {i}\n" for i in range(50)), encoding="utf-8")
+    assert tail_lines(path, 3) == ["line 47", "line 48", "line 49"]
+    assert tail_lines(path, 100) == [f"line {i}" for i in range(50)]
+    assert tail_lines(path, 0) == []
+
+
+def test_clean_history_line_skips_own_invocations():
+    assert outexplain._clean_history_line("outexplain -m why") is None
+    assert outexplain._clean_history_line("  Python  -m outexplain") is None
+    assert outexplain._clean_history_line(": 1700000000:0;git status") == "git status"
+    assert outexplain._clean_history_line(" 203  ls -la") == "ls -la"
+    assert outexplain._clean_history_line("7z x archive.7z") == "7z x archive.7z"
+
+
+def test_read_bashlike_history_prefers_histfile(monkeypatch, tmp_path):
+    histfile = tmp_path / ".zsh_history"
+    histfile.write_text(": 1:0;ls\n: 2:0;make\n: 3:0;outexplain\n: 4:0;git push\n", encoding="utf-8")
+    monkeypatch.setenv("HISTFILE", str(histfile))
+
+    def fail(*args, **kwargs):
+        raise AssertionError("shell should not be spawned when the history file is readable")
+
+    monkeypatch.setattr(outexplain.subprocess, "run", fail)
+    commands, missing_output = outexplain._read_bashlike_history("/bin/zsh", max_count=2)
+    assert missing_output
+    assert [cmd.text for cmd in commands] == ["make", "git push"]
+
+
+def test_read_bashlike_history_skips_timestamps_and_widens_window(monkeypatch, tmp_path):
+    histfile = tmp_path / ".bash_history"
+    entries = ["ls", "make", "git push"] + ["outexplain"] * 10
+    histfile.write_text("".join(f"#170000000{i}\n{cmd}\n" for i, cmd in enumerate(entries)), encoding="utf-8")
+    monkeypatch.setenv("HISTFILE", str(histfile))
+    monkeypatch.setattr(outexplain.subprocess, "run", lambda *a, **k: pytest.fail("shell spawned"))
+    commands, _ = outexplain._read_bashlike_history("/bin/bash", max_count=3)
+    assert [cmd.text for cmd in commands] == ["ls", "make", "git push"]
+
+
+def test_get_shell_reuses_cached_resolution(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "_SHELL_CACHE_PATH", tmp_path / "shell.json")
+    calls = []
+
+    def fake_prompt(name, path):
+        calls.append(name)
+        return "$"
+
+    monkeypatch.setattr(utils, "get_shell_name_and_path", lambda: ("bash", "/bin/bash"))
+    monkeypatch.setattr(utils, "get_shell_prompt", fake_prompt)
+    assert utils.get_shell() == Shell("/bin/bash", "bash", "$")
+    assert utils.get_shell() == Shell("/bin/bash", "bash", "$")
+    assert calls == ["bash"]
+
+    monkeypatch.setenv("SHELL", "/bin/zsh")
+    monkeypatch.setattr(utils, "get_shell_name_and_path", lambda: ("zsh", "/bin/zsh"))
+    assert utils.get_shell().name == "zsh"
+    assert calls == ["bash", "zsh"]
+
+
+def test_get_shell_does_not_cache_failed_prompt_probe(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "_SHELL_CACHE_PATH", tmp_path / "shell.json")
+    prompts = iter([None, "$"])
+    monkeypatch.setattr(utils, "get_shell_name_and_path", lambda: ("bash", "/bin/bash"))
+    monkeypatch.setattr(utils, "get_shell_prompt", lambda name, path: next(prompts))
+    assert utils.get_shell().prompt is None
+    assert utils.get_shell().prompt == "$"
+
+
+def test_get_shell_skips_cache_when_cwd_is_gone(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "_SHELL_CACHE_PATH", tmp_path / "shell.json")
+
+    def deleted_cwd():
+        raise FileNotFoundError("cwd was removed")
+
+    monkeypatch.setattr(utils.os, "getcwd", deleted_cwd)
+    monkeypatch.setattr(utils, "get_shell_name_and_path", lambda: ("bash", "/bin/bash"))
+    monkeypatch.setattr(utils, "get_shell_prompt", lambda name, path: "$")
+    assert utils.get_shell() == Shell("/bin/bash", "bash", "$")
+    assert not (tmp_path / "shell.json").exists()
+
+
+@pytest.mark.skipif(not hasattr(os, "getuid"), reason="POSIX ownership checks")
+def test_shell_cache_ignores_directory_with_foreign_owner(monkeypatch, tmp_path):
+    cache_dir = tmp_path / "cache"
+    monkeypatch.setattr(utils, "_SHELL_CACHE_PATH", cache_dir / "shell.json")
+    monkeypatch.setattr(utils.os, "getuid", lambda: os.stat(tmp_path).st_uid + 1)
+    monkeypatch.setattr(utils, "get_shell_name_and_path", lambda: ("bash", "/bin/bash"))
+    monkeypatch.setattr(utils, "get_shell_prompt", lambda name, path: "$")
+    utils.get_shell()
+    assert not (cache_dir / "shell.json").exists()
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/stat"), reason="requires /proc")
+def test_walk_parents_linux_reaches_current_process_ancestors():
+    chain = list(utils._walk_parents_linux(os.getpid()))
+    assert chain[0][0] == os.getpid()
+    assert chain[1][0] == os.getppid()
+
+
+def test_guess_emulator_prefers_priority_over_chain_position():
+    chain = ["bash", "tmux: server", "gnome-terminal-server", "systemd"]
+    assert utils._guess_emulator_from_process_chain(chain) == "gnome-terminal"
+    assert utils._guess_emulator_from_process_chain(["bash", "Code Helper"]) == "code"
+    assert utils._guess_emulator_from_process_chain(["bash", "sshd"]) is None
+
+
+def test_truncate_pane_output_drops_invocation_and_trailing_blanks(monkeypatch):
+    monkeypatch.setattr("outexplain.utils.MAX_CHARS", 12)
+    pane = "$ make\nbuild failed\nerror: boom\n$ outexplain\n\n   \n"
+    assert truncate_pane_output(pane) == "error: boom"
+    assert truncate_pane_output("\n\n") == ""
+
+
+def test_get_commands_matches_prompt_through_ansi_codes(bash_shell):
+    pane = "\x1b[32m$\x1b[0m ls\nfile.txt\n\x1b[32m$\x1b[0m false\n\x1b[31merror\x1b[0m"
+    commands = get_commands(pane, bash_shell)
+    assert [cmd.text for cmd in commands] == ["ls", "false"]
+    assert commands[1].output == "\x1b[31merror\x1b[0m"
+
+
+def test_truncate_commands_keeps_whole_tail_lines(monkeypatch):
+    monkeypatch.setattr("outexplain.utils.MAX_CHARS", 14)
+    commands = [Command("ls", "alpha\nbeta\ngamma")]
+    assert truncate_commands(commands) == [Command("ls", "beta\ngamma")]
+
+
+def test_build_context_from_commands_layout():
+    context = build_context_from_commands([Command("ls", "a.txt"), Command("false", "")], "$")
+    assert context == (
+        "<terminal_history>\n<previous_commands>\n$ ls\na.txt\n</previous_commands>\n\n"
+        "<last_command>\n$ false\n(output missing)\n</last_command>\n</terminal_history>"
+    )
+
+
+def test_explain_reuses_cached_response(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "_RESPONSE_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(utils, "RESPONSE_CACHE_TTL", 3600)
+    calls = []
+
+    def fake_openai(system_message, user_message, model=None):
+        calls.append(user_message)
+        return "**answer**"
+
+    monkeypatch.setattr(utils, "run_openai", fake_openai)
+    first = utils.explain("<terminal_history>x</terminal_history>", provider="openai")
+    second = utils.explain("<terminal_history>x</terminal_history>", provider="openai")
+    assert first.markup == second.markup == "**answer**"
+    assert len(calls) == 1
+
+    utils.explain("<terminal_history>y</terminal_history>", provider="openai")
+    assert len(calls) == 2
+
+
+def test_expired_cached_response_is_removed(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "RESPONSE_CACHE_TTL", 60)
+    path = tmp_path / "cache" / "stale.md"
+    utils._write_cached_response(path, "old")
+    assert path.parent.stat().st_mode & 0o777 == 0o700
+    os.utime(path, (0, 0))
+    assert utils._read_cached_response(path) is None
+    assert not path.exists()
+
+
+def test_collapse_repeats_shrinks_runs_and_progress_lines():
+    text = "\n".join(["warn: x"] * 5 + ["10%", "55%", "100%", "done"])
+    assert utils._collapse_repeats(text) == "\n".join(
+        ["warn: x"] * 3 + ["... (2 more identical lines)", "... (2 progress lines omitted)", "100%", "done"]
+    )
+    assert utils._collapse_repeats("a\nb\nb\nc") == "a\nb\nb\nc"
+
+
+def test_collapse_repeats_keeps_checkboxes_and_test_banners():
+    text = "\n".join(["[ ] todo", "[----------] 3 tests from Foo", "[==========] Running 3 tests.", "[]"])
+    assert utils._collapse_repeats(text) == text
+
+
+def test_truncate_commands_collapses_before_spending_budget(monkeypatch):
+    monkeypatch.setattr("outexplain.utils.MAX_CHARS", 80)
+    output = "\n".join(["error: missing dep"] + [f"{p}%" for p in range(100)])
+    (command,) = truncate_commands([Command("npm install", output)])
+    assert command.output.startswith("error: missing dep\n")
+    assert command.output.endswith("99%")
+
+
+def test_stream_explanation_caches_complete_responses(monkeypatch, tmp_path):
+    monkeypatch.setattr(utils, "_RESPONSE_CACHE_DIR", tmp_path / "cache")
+    monkeypatch.setattr(utils, "RESPONSE_CACHE_TTL", 3600)
+    monkeypatch.setattr(utils, "stream_anthropic", lambda system, user: iter(["Hel", "lo"]))
+    assert list(utils.stream_explanation("ctx", provider="anthropic")) == ["Hel", "lo"]
+
+    monkeypatch.setattr(utils, "stream_anthropic", lambda system, user: iter(["changed"]))
+    assert list(utils.stream_explanation("ctx", provider="anthropic")) == ["Hello"]
+
+
+def test_explain_batch_preserves_order_and_bounds_concurrency(monkeypatch):
+    monkeypatch.setattr(utils, "RESPONSE_CACHE_TTL", 0)
+    active, peak = 0, 0
+
+    async def fake_call(system_message, user_message):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return user_message.rsplit("\n", 1)[-1]
+
+    monkeypatch.setattr(utils, "_async_runner", lambda provider, model: (fake_call, object()))
+    items = [("ctx", f"q{i}") for i in range(5)]
+    rendered = utils.explain_batch(items, provider="openai", concurrency=2)
+    assert [md.markup for md in rendered] == [f"q{i}" for i in range(5)]
+    assert peak == 2
+
+
+def test_anthropic_message_batch_resumes_after_crash(monkeypatch, tmp_path):
+    from types import SimpleNamespace as NS
+
+    monkeypatch.setattr(utils, "_RESPONSE_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(utils, "BATCH_POLL_INTERVAL", 0)
+    params = utils._anthropic_params("system", "user")
+    statuses = iter(["crash", "in_progress", "ended"])
+    created = []
+
+    class Batches:
+        def create(self, requests):
+            created.append(requests[0]["custom_id"])
+            return NS(id="b1", processing_status="in_progress")
+
+        def retrieve(self, batch_id):
+            status = next(statuses)
+            if status == "crash":
+                raise KeyboardInterrupt
+            return NS(id=batch_id, processing_status=status)
+
+        def results(self, batch_id):
+            message = NS(content=[NS(text="batched answer")])
+            return [NS(custom_id=created[0], result=NS(type="succeeded", message=message))]
+
+    client = NS(messages=NS(batches=Batches()))
+    with pytest.raises(KeyboardInterrupt):
+        utils._run_anthropic_message_batch(client, params)
+
+    assert utils._run_anthropic_message_batch(client, params) == "batched answer"
+    assert len(created) == 1
+    assert not list(tmp_path.glob("batch-*.json"))
+
+
+def test_anthropic_message_batch_times_out_but_keeps_checkpoint(monkeypatch, tmp_path):
+    from types import SimpleNamespace as NS
+
+    monkeypatch.setattr(utils, "_RESPONSE_CACHE_DIR", tmp_path)
+    monkeypatch.setattr(utils, "BATCH_POLL_INTERVAL", 0)
+    monkeypatch.setattr(utils, "BATCH_TIMEOUT", 0)
+
+    class Batches:
+        def create(self, requests):
+            return NS(id="b1", processing_status="in_progress")
+
+    client = NS(messages=NS(batches=Batches()))
+    with pytest.raises(RuntimeError, match="rerun"):
+        utils._run_anthropic_message_batch(client, utils._anthropic_params("system", "user"))
+    assert len(list(tmp_path.glob("batch-*.json"))) == 1